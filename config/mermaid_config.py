@@ -1,3 +1,4 @@
+import os
 from dataclasses import dataclass
 
 # Import centralized credentials
@@ -24,4 +25,10 @@ class DatabaseConfig:
     schema: str = "mermaid_source" # <-- Change 'mermaid_source' to your schema name
 
 # API Configuration
-MERMAID_API_BASE_URL = API_CREDENTIALS.get("mermaid", {}).get("base_url", "https://api.datamermaid.org/v1/projects")
\ No newline at end of file
+MERMAID_API_BASE_URL = API_CREDENTIALS.get("mermaid", {}).get("base_url", "https://api.datamermaid.org/v1/projects")
+
+# Directory for the on-disk cache of Mermaid API responses
+HTTP_CACHE_DIR = os.environ.get(
+    "MERMAID_HTTP_CACHE_DIR",
+    os.path.join(os.environ.get("AIRFLOW_HOME", os.path.expanduser("~/airflow")), "mermaid_cache")
+)
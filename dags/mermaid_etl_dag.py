@@ -1,21 +1,25 @@
 from airflow import DAG
 from airflow.operators.python import PythonOperator
 from datetime import datetime, timedelta
-from typing import Dict
+import json
 import pandas as pd
-import requests
 from airflow.utils.log.logging_mixin import LoggingMixin
 
 from utils.mermaid_utils import (
-    fetch_mermaid_data,
+    fetch_project_tables,
+    combine_project_tables,
     transform_beltfish_data,
     transform_coral_data,
     transform_quadrat_data,
     load_to_database,
     FISH_SURVEY_ENDPOINT,
     CORAL_SURVEY_ENDPOINT,
-    PHOTO_QUADRAT_ENDPOINT
+    PHOTO_QUADRAT_ENDPOINT,
+    FISH_DTYPES,
+    CORAL_DTYPES,
+    QUADRAT_DTYPES
 )
+from utils.http_cache import cached_get
 from config.mermaid_config import DatabaseConfig
 
 def get_org_project_ids() -> list:
@@ -25,9 +29,7 @@ def get_org_project_ids() -> list:
     """
     url = "https://api.datamermaid.org/v1/projects/?showall=true&tags=org"  # <-- Change 'org' to your organization's name
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        data = response.json()
+        data = json.loads(cached_get(url))
         
         # Extract project IDs from the response
         project_ids = [project["id"] for project in data["results"]]
@@ -45,177 +47,133 @@ default_args = {
     'retry_delay': timedelta(minutes=5),
 }
 
-def extract_fish_data(**context):
+def get_project_ids(**context):
+    """Resolve the project IDs for this run once so every survey pipeline uses the same set"""
+    project_ids = context['dag_run'].conf.get('project_ids') or get_org_project_ids()
+    context['task_instance'].xcom_push(key='project_ids', value=project_ids)
+    return "Project ID lookup successful"
+
+def extract_fish_data(**context) -> pd.DataFrame:
     """Extract fish survey data from Mermaid API"""
     logger = LoggingMixin().log
-    project_ids = context['dag_run'].conf.get('project_ids', get_rare_project_ids())
+    project_ids = context['task_instance'].xcom_pull(task_ids='get_project_ids', key='project_ids')
     
     logger.info(f"Fetching fish survey data for project IDs: {project_ids}")
     
-    dfs = []
+    parsed = []
     failed_projects = []
     
-    for project_id in project_ids:
-        logger.info(f"Fetching fish data for project ID: {project_id}")
-        try:
-            df = fetch_mermaid_data(project_id, FISH_SURVEY_ENDPOINT)
-            if not df.empty:
-                dfs.append(df)
-                logger.info(f"Successfully fetched fish data for project ID: {project_id}")
-        except Exception as e:
-            logger.warning(f"Failed to fetch fish data for project ID {project_id}: {str(e)}")
+    for project_id, body, table, error in fetch_project_tables(project_ids, FISH_SURVEY_ENDPOINT, FISH_DTYPES):
+        if error is not None:
+            logger.warning(f"Failed to fetch fish data for project ID {project_id}: {str(error)}")
             failed_projects.append(project_id)
-            continue
+        elif table.num_rows > 0:
+            parsed.append((body, table))
+            logger.info(f"Successfully fetched fish data for project ID: {project_id}")
     
-    if not dfs:
+    if not parsed:
         raise Exception("No fish survey data could be fetched from any project")
     
-    combined_df = pd.concat(dfs, ignore_index=True)
+    combined_df = combine_project_tables(parsed, FISH_DTYPES)
     
-    context['task_instance'].xcom_push(key='fish_data', value=combined_df.to_dict())
     context['task_instance'].xcom_push(key='fish_data_shape', value=combined_df.shape)
     context['task_instance'].xcom_push(key='failed_projects', value=failed_projects)
-    return "Fish data extraction successful"
+    return combined_df
 
-def extract_coral_data(**context):
+def extract_coral_data(**context) -> pd.DataFrame:
     """Extract coral survey data from Mermaid API"""
     logger = LoggingMixin().log
-    project_ids = context['dag_run'].conf.get('project_ids', get_rare_project_ids())
+    project_ids = context['task_instance'].xcom_pull(task_ids='get_project_ids', key='project_ids')
     
     logger.info(f"Fetching coral survey data for project IDs: {project_ids}")
     
-    dfs = []
+    parsed = []
     failed_projects = []
     
-    for project_id in project_ids:
-        logger.info(f"Fetching coral data for project ID: {project_id}")
-        try:
-            df = fetch_mermaid_data(project_id, CORAL_SURVEY_ENDPOINT)
-            if not df.empty:
-                dfs.append(df)
-                logger.info(f"Successfully fetched coral data for project ID: {project_id}")
-        except Exception as e:
-            logger.warning(f"Failed to fetch coral data for project ID {project_id}: {str(e)}")
+    for project_id, body, table, error in fetch_project_tables(project_ids, CORAL_SURVEY_ENDPOINT, CORAL_DTYPES):
+        if error is not None:
+            logger.warning(f"Failed to fetch coral data for project ID {project_id}: {str(error)}")
             failed_projects.append(project_id)
-            continue
+        elif table.num_rows > 0:
+            parsed.append((body, table))
+            logger.info(f"Successfully fetched coral data for project ID: {project_id}")
     
-    if not dfs:
+    if not parsed:
         raise Exception("No coral survey data could be fetched from any project")
     
-    combined_df = pd.concat(dfs, ignore_index=True)
+    combined_df = combine_project_tables(parsed, CORAL_DTYPES)
     
-    context['task_instance'].xcom_push(key='coral_data', value=combined_df.to_dict())
     context['task_instance'].xcom_push(key='coral_data_shape', value=combined_df.shape)
     context['task_instance'].xcom_push(key='failed_coral_projects', value=failed_projects)
-    return "Coral data extraction successful"
-
-def transform_data(**context):
-    """Transform the extracted data"""
-    logger = LoggingMixin().log
-    logger.info("Starting data transformation")
-    
-    fish_data = context['task_instance'].xcom_pull(key='fish_data')
-    df = pd.DataFrame.from_dict(fish_data)
-    
-    logger.info(f"Raw data columns: {df.columns.tolist()}")
-    logger.info(f"Raw data shape: {df.shape}")
-    
-    transformed_df = transform_beltfish_data(df)
-    
-    logger.info("Data transformation completed")
-    
-    # Convert datetime columns to string format for XCom serialization
-    for col in transformed_df.select_dtypes(include=['datetime64[ns]']).columns:
-        transformed_df[col] = transformed_df[col].dt.strftime('%Y-%m-%d %H:%M:%S')
-    
-    context['task_instance'].xcom_push(key='transformed_data', value=transformed_df.to_dict())
-    return "Data transformation successful"
+    return combined_df
 
-def transform_coral_task(**context):
-    """Transform coral data task"""
-    coral_data = context['task_instance'].xcom_pull(key='coral_data')
-    if not coral_data:
-        raise ValueError("No coral data found in XCom")
-    
-    df = pd.DataFrame.from_dict(coral_data)
-    transformed_df = transform_coral_data(df)
-    
-    # Convert DataFrame to dict and ensure all values are JSON serializable
-    transformed_dict = transformed_df.to_dict(orient='records')
-    context['task_instance'].xcom_push(key='transformed_coral_data', value=transformed_dict)
-    return "Coral data transformation successful"
-
-def load_data(**context):
-    """Load transformed data to database"""
-    transformed_data = context['task_instance'].xcom_pull(key='transformed_data')
-    df = pd.DataFrame.from_dict(transformed_data)
-    
-    db_config = DatabaseConfig()
-    load_to_database(df, 'beltfish_surveys', db_config)
-    return "Data loading successful"
-
-def load_coral_data(**context):
-    """Load transformed coral data to database"""
-    transformed_data = context['task_instance'].xcom_pull(key='transformed_coral_data')
-    df = pd.DataFrame.from_dict(transformed_data)
-    
-    db_config = DatabaseConfig()
-    load_to_database(df, 'benthic_surveys', db_config)
-    return "Coral data loading successful"
-
-def extract_quadrat_data(**context):
+def extract_quadrat_data(**context) -> pd.DataFrame:
     """Extract photo quadrat data from Mermaid API"""
     logger = LoggingMixin().log
-    project_ids = context['dag_run'].conf.get('project_ids', get_rare_project_ids())
+    project_ids = context['task_instance'].xcom_pull(task_ids='get_project_ids', key='project_ids')
     
     logger.info(f"Fetching photo quadrat data for project IDs: {project_ids}")
     
-    dfs = []
+    parsed = []
     failed_projects = []
     
-    for project_id in project_ids:
-        logger.info(f"Fetching photo quadrat data for project ID: {project_id}")
-        try:
-            df = fetch_mermaid_data(project_id, PHOTO_QUADRAT_ENDPOINT)
-            if not df.empty:
-                dfs.append(df)
-                logger.info(f"Successfully fetched photo quadrat data for project ID: {project_id}")
-        except Exception as e:
-            logger.warning(f"Failed to fetch photo quadrat data for project ID {project_id}: {str(e)}")
+    for project_id, body, table, error in fetch_project_tables(project_ids, PHOTO_QUADRAT_ENDPOINT, QUADRAT_DTYPES):
+        if error is not None:
+            logger.warning(f"Failed to fetch photo quadrat data for project ID {project_id}: {str(error)}")
             failed_projects.append(project_id)
-            continue
+        elif table.num_rows > 0:
+            parsed.append((body, table))
+            logger.info(f"Successfully fetched photo quadrat data for project ID: {project_id}")
     
-    if not dfs:
+    if not parsed:
         raise Exception("No photo quadrat data could be fetched from any project")
          
-    combined_df = pd.concat(dfs, ignore_index=True)
+    combined_df = combine_project_tables(parsed, QUADRAT_DTYPES)
     
-    context['task_instance'].xcom_push(key='quadrat_data', value=combined_df.to_dict())
     context['task_instance'].xcom_push(key='quadrat_data_shape', value=combined_df.shape)
     context['task_instance'].xcom_push(key='failed_quadrat_projects', value=failed_projects)
-    return "Photo quadrat data extraction successful"
+    return combined_df
+
+def run_fish_pipeline(**context):
+    """Extract, transform and load fish survey data in a single task"""
+    logger = LoggingMixin().log
+    df = extract_fish_data(**context)
+    
+    logger.info(f"Raw data columns: {df.columns.tolist()}")
+    logger.info(f"Raw data shape: {df.shape}")
+    
+    transformed_df = transform_beltfish_data(df)
+    logger.info(f"Transformed data shape: {transformed_df.shape}")
+    
+    db_config = DatabaseConfig()
+    load_to_database(transformed_df, 'beltfish_surveys', db_config)
+    return "Fish pipeline successful"
 
-def transform_quadrat_task(**context):
-    """Transform photo quadrat data task"""
-    quadrat_data = context['task_instance'].xcom_pull(key='quadrat_data')
-    if not quadrat_data:
-        raise ValueError("No photo quadrat data found in XCom")
+def run_coral_pipeline(**context):
+    """Extract, transform and load coral survey data in a single task"""
+    logger = LoggingMixin().log
+    df = extract_coral_data(**context)
+    logger.info(f"Raw coral data shape: {df.shape}")
     
-    df = pd.DataFrame.from_dict(quadrat_data)
-    transformed_df = transform_quadrat_data(df)  # Use the specific quadrat transform function
+    transformed_df = transform_coral_data(df)
+    logger.info(f"Transformed coral data shape: {transformed_df.shape}")
     
-    transformed_dict = transformed_df.to_dict(orient='records')
-    context['task_instance'].xcom_push(key='transformed_quadrat_data', value=transformed_dict)
-    return "Photo quadrat data transformation successful"
+    db_config = DatabaseConfig()
+    load_to_database(transformed_df, 'benthic_surveys', db_config)
+    return "Coral pipeline successful"
 
-def load_quadrat_data(**context):
-    """Load transformed photo quadrat data to database"""
-    transformed_data = context['task_instance'].xcom_pull(key='transformed_quadrat_data')
-    df = pd.DataFrame.from_dict(transformed_data)
+def run_quadrat_pipeline(**context):
+    """Extract, transform and load photo quadrat data in a single task"""
+    logger = LoggingMixin().log
+    df = extract_quadrat_data(**context)
+    logger.info(f"Raw photo quadrat data shape: {df.shape}")
+    
+    transformed_df = transform_quadrat_data(df)
+    logger.info(f"Transformed photo quadrat data shape: {transformed_df.shape}")
     
     db_config = DatabaseConfig()
-    load_to_database(df, 'benthic_photo_quadrat_surveys', db_config)
-    return "Photo quadrat data loading successful"
+    load_to_database(transformed_df, 'benthic_photo_quadrat_surveys', db_config)
+    return "Photo quadrat pipeline successful"
 
 # Create the DAG
 with DAG(
@@ -225,70 +183,41 @@ with DAG(
     schedule_interval='0 2 * * *',  # Run once per day at 2 AM
     start_date=datetime(2024, 1, 1),
     catchup=False,
+    max_active_tasks=8,
+    max_active_runs=1,
     tags=['mermaid', 'etl'],
 ) as dag:
 
-    # Extract task
-    extract_fish = PythonOperator(
-        task_id='extract_fish_data',
-        python_callable=extract_fish_data,
+    # Project ID lookup shared by all pipelines
+    lookup_project_ids = PythonOperator(
+        task_id='get_project_ids',
+        python_callable=get_project_ids,
         provide_context=True,
     )
 
-    # Transform task
-    transform_fish = PythonOperator(
-        task_id='transform_fish_data',
-        python_callable=transform_data,
+    # Fish survey pipeline
+    fish_pipeline = PythonOperator(
+        task_id='fish_pipeline',
+        python_callable=run_fish_pipeline,
         provide_context=True,
+        pool='mermaid_fish',
     )
 
-    # Load task
-    load_fish = PythonOperator(
-        task_id='load_fish_data',
-        python_callable=load_data,
+    # Coral survey pipeline
+    coral_pipeline = PythonOperator(
+        task_id='coral_pipeline',
+        python_callable=run_coral_pipeline,
         provide_context=True,
+        pool='mermaid_coral',
     )
 
-    # Extract task
-    extract_corals = PythonOperator(
-        task_id='extract_coral_data',
-        python_callable=extract_coral_data,
+    # Photo quadrat survey pipeline
+    quadrat_pipeline = PythonOperator(
+        task_id='quadrat_pipeline',
+        python_callable=run_quadrat_pipeline,
         provide_context=True,
-    )
-
-    # Transform task
-    transform_corals = PythonOperator(
-        task_id='transform_coral_data',
-        python_callable=transform_coral_task,
-        provide_context=True,
-    )
-
-    # Load task
-    load_corals = PythonOperator(
-        task_id='load_coral_data',
-        python_callable=load_coral_data,
-        provide_context=True,
-    )
-
-    extract_quadrats = PythonOperator(
-        task_id='extract_quadrat_data',
-        python_callable=extract_quadrat_data,
-        provide_context=True
-    )
-    
-    transform_quadrats = PythonOperator(
-        task_id='transform_quadrat_data',
-        python_callable=transform_quadrat_task,
-        provide_context=True
-    )
-    
-    load_quadrats = PythonOperator(
-        task_id='load_quadrat_data',
-        python_callable=load_quadrat_data,
-        provide_context=True
+        pool='mermaid_quadrat',
     )
 
     # Set task dependencies
-    extract_fish >> transform_fish >> load_fish
-    extract_corals >> transform_corals >> load_corals
-    extract_quadrats >> transform_quadrats >> load_quadrats 
\ No newline at end of file
+    lookup_project_ids >> [fish_pipeline, coral_pipeline, quadrat_pipeline]
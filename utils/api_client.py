@@ -0,0 +1,42 @@
+import asyncio
+from typing import Dict, List, Union
+import httpx
+from utils.http_cache import conditional_headers, resolve_response
+
+# Upper bound on simultaneous connections to the Mermaid API
+MAX_CONNECTIONS = 16
+
+# Seconds to wait on any single network operation
+REQUEST_TIMEOUT = 60.0
+
+def _resolve_csv(url: str, response: httpx.Response) -> bytes:
+    """Check one response and return its body, revalidated against the disk cache"""
+    if response.status_code != 304:
+        response.raise_for_status()
+    return resolve_response(url, response.status_code, response.headers, response.content)
+
+async def fetch_all_csv(urls: List[str]) -> List[Union[bytes, Exception]]:
+    """
+    Fetch all CSV URLs concurrently over a shared HTTP/2 client.
+    Results are returned in the order of urls; a failed fetch yields its exception in place of the body.
+    """
+    # Cache reads and writes hit disk, so keep them out of the window where requests are in flight
+    headers: Dict[str, dict] = {url: conditional_headers(url) for url in urls}
+    
+    limits = httpx.Limits(max_connections=MAX_CONNECTIONS)
+    async with httpx.AsyncClient(http2=True, limits=limits, timeout=REQUEST_TIMEOUT) as client:
+        responses = await asyncio.gather(
+            *(client.get(url, headers=headers[url]) for url in urls),
+            return_exceptions=True
+        )
+    
+    results = []
+    for url, response in zip(urls, responses):
+        if isinstance(response, Exception):
+            results.append(response)
+            continue
+        try:
+            results.append(_resolve_csv(url, response))
+        except Exception as e:
+            results.append(e)
+    return results
@@ -0,0 +1,66 @@
+import functools
+import logging
+import requests
+from config.mermaid_config import HTTP_CACHE_DIR
+
+logger = logging.getLogger(__name__)
+
+try:
+    import diskcache
+except ImportError:
+    # Fallback for when diskcache isn't installed: responses are fetched uncached
+    logger.warning("diskcache not installed. Mermaid API responses will not be cached.")
+    diskcache = None
+
+# Upper bound on the on-disk size of cached API responses (4 GiB)
+HTTP_CACHE_SIZE_LIMIT = 2**32
+
+@functools.lru_cache(maxsize=1)
+def _get_cache():
+    """
+    Open the response cache on first use so importing the DAG never touches the disk.
+    Returns None when the cache is unavailable, in which case requests go out unconditionally.
+    """
+    if diskcache is None:
+        return None
+    try:
+        return diskcache.Cache(HTTP_CACHE_DIR, size_limit=HTTP_CACHE_SIZE_LIMIT)
+    except OSError as e:
+        logger.warning(f"Could not open HTTP cache at {HTTP_CACHE_DIR}, fetching uncached: {str(e)}")
+        return None
+
+def conditional_headers(url: str) -> dict:
+    """Build If-None-Match/If-Modified-Since headers from the cached response for url"""
+    cache = _get_cache()
+    cached = cache.get(url) if cache is not None else None
+    if cached is None:
+        return {}
+    etag, last_modified, _ = cached
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+def resolve_response(url: str, status_code: int, headers, body: bytes) -> bytes:
+    """Return the cached body on 304, otherwise cache the fresh body and return it"""
+    cache = _get_cache()
+    if status_code == 304:
+        cached = cache.get(url) if cache is not None else None
+        if cached is None:
+            raise Exception(f"Received 304 Not Modified for {url} but no cached response exists")
+        return cached[2]
+    etag = headers.get('ETag')
+    last_modified = headers.get('Last-Modified')
+    if cache is not None and (etag or last_modified):
+        cache.set(url, (etag, last_modified, body))
+    return body
+
+def cached_get(url: str) -> bytes:
+    """GET url, revalidating against the disk cache, and return the response body"""
+    response = requests.get(url, headers=conditional_headers(url))
+    logger.debug(f"Response status code: {response.status_code}")
+    if response.status_code != 304:
+        response.raise_for_status()
+    return resolve_response(url, response.status_code, response.headers, response.content)
@@ -1,9 +1,15 @@
+import asyncio
+import functools
+from collections import defaultdict
 import pandas as pd
-import requests
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 from io import StringIO
-from typing import Dict, Any
-from sqlalchemy import create_engine, text, String
+from typing import Dict, Any, List, Tuple
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
 from config.mermaid_config import DatabaseConfig
+from utils.api_client import fetch_all_csv
 import numpy as np
 
 # API Endpoints
@@ -12,7 +18,7 @@ CORAL_SURVEY_ENDPOINT = "benthicpits/obstransectbenthicpits"
 PHOTO_QUADRAT_ENDPOINT = "benthicpqts/obstransectbenthicpqts"
 
 # Fish text columns
-FISH_TEXT_COLUMNS = [
+FISH_TEXT_COLUMNS = frozenset({
     'project_name', 
     'project_admins', 
     'country_name', 
@@ -52,10 +58,10 @@ FISH_TEXT_COLUMNS = [
     'management_id', 
     'sample_event_id', 
     'sample_unit_id'
-]
+})
 
 # Benthic text columns
-BENTHIC_TEXT_COLUMNS = [
+BENTHIC_TEXT_COLUMNS = frozenset({
     'project_name',
     'project_admins',
     'country_name',
@@ -82,10 +88,10 @@ BENTHIC_TEXT_COLUMNS = [
     'sample_unit_notes',
     'project_notes',
     'data_policy_benthicpit'
-]
+})
 
 # Photo Quadrat text columns
-PHOTO_QUADRAT_TEXT_COLUMNS = [
+PHOTO_QUADRAT_TEXT_COLUMNS = frozenset({
     'project_name',
     'project_admins',
     'country_name',
@@ -122,147 +128,253 @@ PHOTO_QUADRAT_TEXT_COLUMNS = [
     'management_id',
     'sample_event_id',
     'sample_unit_id'
-]
+})
 
-def fetch_mermaid_data(project_id: str, endpoint: str) -> pd.DataFrame:
-    """Fetch data from DataMermaid API"""
-    url = f"https://api.datamermaid.org/v1/projects/{project_id}/{endpoint}/csv/"
+# Arrow column types passed to the CSV parser per endpoint. sample_time is
+# included so it is read as a plain string rather than a time-of-day value.
+FISH_DTYPES = {column: pa.string() for column in FISH_TEXT_COLUMNS | {'sample_time'}}
+CORAL_DTYPES = {column: pa.string() for column in BENTHIC_TEXT_COLUMNS | {'sample_time'}}
+QUADRAT_DTYPES = {column: pa.string() for column in PHOTO_QUADRAT_TEXT_COLUMNS | {'sample_time'}}
+
+# Text columns whose few distinct values repeat across many rows, stored as categoricals
+LOW_CARDINALITY_COLUMNS = frozenset({
+    'country_name',
+    'reef_exposure',
+    'reef_slope',
+    'reef_type',
+    'reef_zone',
+    'tide_name',
+    'visibility_name',
+    'current_name',
+    'relative_depth',
+    'management_name',
+    'fish_family',
+    'fish_genus',
+    'trophic_group',
+    'functional_group',
+    'benthic_category',
+    'benthic_attribute',
+    'growth_form'
+})
+
+def categorize_low_cardinality_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert repetitive text columns to category dtype. Modifies df in place."""
+    for column in df.columns.intersection(LOW_CARDINALITY_COLUMNS):
+        df[column] = df[column].astype('category')
+    return df
+
+def mermaid_csv_url(project_id: str, endpoint: str) -> str:
+    """Build the CSV export URL for one project's endpoint"""
+    return f"https://api.datamermaid.org/v1/projects/{project_id}/{endpoint}/csv/"
+
+def parse_mermaid_csv(body: bytes, dtype: Dict[str, pa.DataType] = None) -> pa.Table:
+    """Parse a Mermaid CSV export into an Arrow table"""
+    if not body:
+        print("Empty response received")
+        return pa.table({})
+    return pa_csv.read_csv(
+        pa.BufferReader(body),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=dtype or {},
+            # Read empty cells in string columns as null, as pd.read_csv did
+            strings_can_be_null=True
+        )
+    )
+
+def fetch_project_tables(project_ids: list, endpoint: str, dtype: Dict[str, pa.DataType] = None) -> list:
+    """
+    Fetch data for all projects concurrently, returning (project_id, body, table, error) for each.
+    The raw CSV body is kept so combine_project_tables can re-read columns whose types conflict.
+    """
+    urls = [mermaid_csv_url(project_id, endpoint) for project_id in project_ids]
+    bodies = asyncio.run(fetch_all_csv(urls))
     
-    print(f"Fetching data from URL: {url}")
+    results = []
+    for project_id, body in zip(project_ids, bodies):
+        if isinstance(body, Exception):
+            results.append((project_id, None, None, body))
+            continue
+        try:
+            results.append((project_id, body, parse_mermaid_csv(body, dtype), None))
+        except Exception as e:
+            results.append((project_id, body, None, e))
+    return results
+
+def _find_conflicting_columns(tables: List[pa.Table]) -> set:
+    """Find columns whose inferred types cannot be promoted to a common type across tables"""
+    column_types = defaultdict(set)
+    for table in tables:
+        for field in table.schema:
+            if not pa.types.is_null(field.type):
+                column_types[field.name].add(field.type)
+    
+    conflicting = set()
+    for name, types in column_types.items():
+        if len(types) < 2:
+            continue
+        try:
+            pa.unify_schemas([pa.schema([pa.field(name, t)]) for t in types], promote_options='permissive')
+        except (pa.ArrowTypeError, pa.ArrowInvalid):
+            conflicting.add(name)
+    return conflicting
+
+def combine_project_tables(
+    parsed: List[Tuple[bytes, pa.Table]],
+    dtype: Dict[str, pa.DataType] = None
+) -> pd.DataFrame:
+    """Concatenate per-project (body, table) pairs and convert the result to pandas once"""
+    tables = [table for _, table in parsed]
     try:
-        response = requests.get(url)
-        print(f"Response status code: {response.status_code}")
-        response.raise_for_status()
-        if response.text:
-            print(f"First 500 characters of response: {response.text[:500]}")
-            df = pd.read_csv(StringIO(response.text))
-            if df.empty:
-                print(f"Empty dataset received for project {project_id}")
-            return df
-        else:
-            print("Empty response received")
-            return pd.DataFrame()
-    except requests.exceptions.RequestException as e:
-        print(f"Failed to fetch data: {str(e)}")
-        raise
+        combined = pa.concat_tables(tables, promote_options='permissive')
+    except (pa.ArrowTypeError, pa.ArrowInvalid):
+        # A project's values were inferred as an incompatible type (e.g. a stray
+        # non-numeric value in a numeric column), so re-read those columns as
+        # strings to keep the source text exactly as the API sent it
+        column_types = dict(dtype or {})
+        column_types.update({name: pa.string() for name in _find_conflicting_columns(tables)})
+        tables = [parse_mermaid_csv(body, column_types) for body, _ in parsed]
+        combined = pa.concat_tables(tables, promote_options='permissive')
+    return categorize_low_cardinality_columns(combined.to_pandas())
 
-def transform_beltfish_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Transform beltfish data according to requirements"""
-    transformed_df = df.copy()
+def _sample_time_to_timedelta(sample_time: pd.Series) -> pd.Series:
+    """Convert sample times to offsets from midnight, treating missing times as midnight"""
+    times = sample_time.astype('string').str.strip()
+    missing = times.isna() | (times == '')
+    # pd.to_timedelta only accepts hh:mm:ss, so pad hh:mm values with seconds
+    times = times.where(~times.str.fullmatch(r'\d{1,2}:\d{2}').fillna(False), times + ':00')
+    times = times.where(~missing, '00:00:00').astype(object)
     
+    offsets = pd.to_timedelta(times, errors='coerce')
+    # Values without a colon would otherwise be read as a count of nanoseconds
+    invalid = ~missing & (offsets.isna() | ~times.str.contains(':'))
+    if invalid.any():
+        raise ValueError(f"Unparseable sample_time values: {sample_time[invalid].unique()[:10].tolist()}")
+    return offsets
+
+def transform_beltfish_data(df: pd.DataFrame) -> pd.DataFrame:
+    """Transform beltfish data according to requirements. Modifies df in place."""
     # Combine date fields into a single datetime column
-    transformed_df['date'] = pd.to_datetime(
-        transformed_df['sample_date_year'].astype(str) + '-' + 
-        transformed_df['sample_date_month'].astype(str) + '-' + 
-        transformed_df['sample_date_day'].astype(str)
+    df['date'] = pd.to_datetime(
+        df[['sample_date_year', 'sample_date_month', 'sample_date_day']].set_axis(
+            ['year', 'month', 'day'], axis=1
+        )
     )
 
     # Add time if available
-    if 'sample_time' in transformed_df.columns:
-        transformed_df['datetime'] = pd.to_datetime(
-            transformed_df['date'].astype(str) + ' ' + 
-            transformed_df['sample_time'].fillna('00:00:00')
-        )
+    if 'sample_time' in df.columns:
+        df['datetime'] = df['date'] + _sample_time_to_timedelta(df['sample_time'])
+
+    # Store dates as text in the format existing beltfish_surveys tables already hold
+    for column in ['date', 'datetime']:
+        if column in df.columns:
+            df[column] = df[column].dt.strftime('%Y-%m-%d %H:%M:%S')
 
     # Handle numeric columns
-    transformed_df['biomass_kgha'] = transformed_df['biomass_kgha'].fillna(0)
+    df['biomass_kgha'] = df['biomass_kgha'].fillna(0)
 
     # Log the transformation results
-    print(f"Transformed data shape: {transformed_df.shape}")
-    print(f"Transformed columns: {transformed_df.columns.tolist()}")
-    print(f"First few rows of transformed data:\n{transformed_df.head()}")
+    print(f"Transformed data shape: {df.shape}")
+    print(f"Transformed columns: {df.columns.tolist()}")
+    print(f"First few rows of transformed data:\n{df.head()}")
     
-    return transformed_df
+    return df
 
 def transform_coral_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Transform coral data according to requirements"""
-    transformed_df = df.copy()
-    
+    """Transform coral data according to requirements. Modifies df in place."""
     # Combine date fields into a single datetime column
-    transformed_df['date'] = pd.to_datetime(
-        transformed_df['sample_date_year'].astype(str) + '-' + 
-        transformed_df['sample_date_month'].astype(str) + '-' + 
-        transformed_df['sample_date_day'].astype(str)
+    df['date'] = pd.to_datetime(
+        df[['sample_date_year', 'sample_date_month', 'sample_date_day']].set_axis(
+            ['year', 'month', 'day'], axis=1
+        )
     )
 
     # Add time if available
-    if 'sample_time' in transformed_df.columns:
-        transformed_df['datetime'] = pd.to_datetime(
-            transformed_df['date'].astype(str) + ' ' + 
-            transformed_df['sample_time'].fillna('00:00:00')
-        )
+    if 'sample_time' in df.columns:
+        df['datetime'] = df['date'] + _sample_time_to_timedelta(df['sample_time'])
 
-    # Convert datetime columns to string format for JSON serialization
-    transformed_df['date'] = transformed_df['date'].dt.strftime('%Y-%m-%d')
-    transformed_df['datetime'] = transformed_df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+    # Store dates as text in the format existing survey tables already hold
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    df['datetime'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
 
     # Handle numeric columns specific to coral data
-    if 'percent_cover' in transformed_df.columns:
-        transformed_df['percent_cover'] = transformed_df['percent_cover'].fillna(0)
+    if 'percent_cover' in df.columns:
+        df['percent_cover'] = df['percent_cover'].fillna(0)
 
     # Log the transformation results
-    print(f"Transformed coral data shape: {transformed_df.shape}")
-    print(f"Transformed columns: {transformed_df.columns.tolist()}")
-    print(f"First few rows of transformed data:\n{transformed_df.head()}")
+    print(f"Transformed coral data shape: {df.shape}")
+    print(f"Transformed columns: {df.columns.tolist()}")
+    print(f"First few rows of transformed data:\n{df.head()}")
     
-    return transformed_df
+    return df
 
 def transform_quadrat_data(df: pd.DataFrame) -> pd.DataFrame:
-    """Transform photo quadrat data according to requirements"""
-    transformed_df = df.copy()
-    
+    """Transform photo quadrat data according to requirements. Modifies df in place."""
     # Combine date fields into a single datetime column, handling different formats
     try:
         # Ensure year is 4 digits
-        transformed_df['sample_date_year'] = transformed_df['sample_date_year'].apply(
+        df['sample_date_year'] = df['sample_date_year'].apply(
             lambda x: x if len(str(x)) == 4 else f"20{str(x).zfill(2)}"
         )
 
-        transformed_df['date'] = pd.to_datetime(
+        df['date'] = pd.to_datetime(
             pd.DataFrame({
-                'year': transformed_df['sample_date_year'],
-                'month': transformed_df['sample_date_month'],
-                'day': transformed_df['sample_date_day']
+                'year': df['sample_date_year'],
+                'month': df['sample_date_month'],
+                'day': df['sample_date_day']
             })
         )
 
         # Add time if available
-        if 'sample_time' in transformed_df.columns:
-            transformed_df['datetime'] = pd.to_datetime(
-                transformed_df['date'].astype(str) + ' ' + 
-                transformed_df['sample_time'].fillna('00:00:00')
-            )
-
-        # Convert datetime columns to string format for JSON serialization
-        transformed_df['date'] = transformed_df['date'].dt.strftime('%Y-%m-%d')
-        transformed_df['datetime'] = transformed_df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
+        if 'sample_time' in df.columns:
+            df['datetime'] = df['date'] + _sample_time_to_timedelta(df['sample_time'])
+
+        # Store dates as text in the format existing survey tables already hold
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+        df['datetime'] = df['datetime'].dt.strftime('%Y-%m-%d %H:%M:%S')
     except Exception as e:
         print(f"Error processing dates: {str(e)}")
         print("Sample of problematic data:")
-        print(transformed_df[['sample_date_year', 'sample_date_month', 'sample_date_day']].head())
+        print(df[['sample_date_year', 'sample_date_month', 'sample_date_day']].head())
         print("\nUnique values in date fields:")
-        print("Years:", transformed_df['sample_date_year'].unique())
-        print("Months:", transformed_df['sample_date_month'].unique())
-        print("Days:", transformed_df['sample_date_day'].unique())
+        print("Years:", df['sample_date_year'].unique())
+        print("Months:", df['sample_date_month'].unique())
+        print("Days:", df['sample_date_day'].unique())
         raise
 
     # Handle numeric columns specific to photo quadrat data
     numeric_columns = ['quadrat_size', 'num_quadrats', 'num_points_per_quadrat', 'num_points']
     for col in numeric_columns:
-        if col in transformed_df.columns:
-            transformed_df[col] = transformed_df[col].fillna(0)
+        if col in df.columns:
+            df[col] = df[col].fillna(0)
 
     # Log the transformation results
-    print(f"Transformed photo quadrat data shape: {transformed_df.shape}")
-    print(f"Transformed columns: {transformed_df.columns.tolist()}")
-    print(f"First few rows of transformed data:\n{transformed_df.head()}")
+    print(f"Transformed photo quadrat data shape: {df.shape}")
+    print(f"Transformed columns: {df.columns.tolist()}")
+    print(f"First few rows of transformed data:\n{df.head()}")
     
-    return transformed_df
+    return df
+
+def _integral_floats_to_nullable_int(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return df with whole-number float columns as nullable Int64.
+    Integer columns holding nulls are read as float64, and COPY rejects values like '3.0' for BIGINT columns.
+    """
+    converted = {}
+    for column in df.select_dtypes(include='float').columns:
+        values = df[column].dropna()
+        if not values.empty and (values % 1 == 0).all():
+            converted[column] = df[column].astype('Int64')
+    return df.assign(**converted) if converted else df
+
+@functools.lru_cache(maxsize=4)
+def _get_engine(host: str, port: int, database: str, user: str, password: str) -> Engine:
+    """Return a process-wide engine so repeated loads reuse its connection pool"""
+    connection_string = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
+    return create_engine(connection_string, pool_pre_ping=True, pool_size=8)
 
 def load_to_database(df: pd.DataFrame, table_name: str, db_config: DatabaseConfig) -> None:
     """Load DataFrame to PostgreSQL database"""
-    connection_string = f"postgresql://{db_config.user}:{db_config.password}@{db_config.host}:{db_config.port}/{db_config.database}"
-    engine = create_engine(connection_string)
+    engine = _get_engine(db_config.host, db_config.port, db_config.database, db_config.user, db_config.password)
     
     # Map pandas/numpy dtypes to PostgreSQL types
     dtype_mapping = {
@@ -289,15 +401,15 @@ def load_to_database(df: pd.DataFrame, table_name: str, db_config: DatabaseConfi
                 connection.execute(text(f'CREATE SCHEMA IF NOT EXISTS {db_config.schema}'))
                 
                 # Generate column definitions
-                columns = []
-                for column, dtype in df.dtypes.items():
-                    pg_type = 'TEXT' if column in text_columns else dtype_mapping.get(str(dtype), 'TEXT')
-                    columns.append(f'"{column}" {pg_type}')
+                columns_sql = ', '.join(
+                    f'"{column}" {"TEXT" if column in text_columns else dtype_mapping.get(str(dtype), "TEXT")}'
+                    for column, dtype in df.dtypes.items()
+                )
                 
                 # Create table with proper schema
                 create_table_sql = f"""
                 CREATE TABLE IF NOT EXISTS {db_config.schema}.{table_name} (
-                    {', '.join(columns)}
+                    {columns_sql}
                 )
                 """
                 connection.execute(text(create_table_sql))
@@ -305,29 +417,36 @@ def load_to_database(df: pd.DataFrame, table_name: str, db_config: DatabaseConfi
         # Check if this project's data already exists
         project_ids = df['project_id'].unique()
         with engine.connect() as connection:
-            for project_id in project_ids:
-                result = connection.execute(
-                    text(f"SELECT COUNT(*) FROM {db_config.schema}.{table_name} WHERE project_id = :project_id"),
-                    {"project_id": project_id}
-                ).scalar()
-                if result > 0:
-                    print(f"Data for project {project_id} already exists. Skipping import.")
-                    df = df[df['project_id'] != project_id]
+            existing = {
+                row[0] for row in connection.execute(
+                    text(f"SELECT DISTINCT project_id FROM {db_config.schema}.{table_name} WHERE project_id = ANY(:ids)"),
+                    {"ids": list(project_ids)}
+                )
+            }
+        if existing:
+            print(f"Data for projects {sorted(existing)} already exists. Skipping import.")
+            df = df.loc[~df['project_id'].isin(existing)]
         
         if df.empty:
             print("No new data to import")
             return
 
-        # Insert data with correct column types
-        df.to_sql(
-            name=table_name,
-            con=engine,
-            schema=db_config.schema,
-            if_exists='append',
-            index=False,
-            dtype={col: String for col in text_columns}
+        # Stream data into the table with a single COPY instead of row-by-row INSERTs
+        buffer = StringIO()
+        df = _integral_floats_to_nullable_int(df)
+        df.to_csv(buffer, index=False, header=False, sep='\t', na_rep='\\N')
+        buffer.seek(0)
+        column_list = ', '.join(f'"{column}"' for column in df.columns)
+        copy_sql = (
+            f"COPY {db_config.schema}.{table_name} ({column_list}) "
+            f"FROM STDIN WITH (FORMAT CSV, DELIMITER E'\\t', NULL '\\N')"
         )
+        raw_connection = engine.raw_connection()
+        try:
+            with raw_connection.cursor() as cursor:
+                cursor.copy_expert(copy_sql, buffer)
+            raw_connection.commit()
+        finally:
+            raw_connection.close()
     except Exception as e:
-        raise Exception(f"Failed to load data to database: {str(e)}")
-    finally:
-        engine.dispose() 
\ No newline at end of file
+        raise Exception(f"Failed to load data to database: {str(e)}") 
\ No newline at end of file